@@ -1,12 +1,13 @@
 import json
 
-from PyFlowFields.flows import FlowSimulation
+from PyFlowFields.flows import FlowSimulation, FlowPlaylist
 from PyFlowFields.flows.flow_settings import *
 
 
 if __name__ == "__main__":
 	parser = argparse.ArgumentParser("PyFlowFields", description="Create a flow simulation from a command interpreter")
 	parser.add_argument("-cfg", help="Parse config from a .json file", metavar="filename")
+	parser.add_argument("-playlist", help="Play the scenes listed in a .json file one after the other", metavar="filename")
 
 	SimulationSettings.add_arguments(parser)
 	FlowFieldSettings.add_arguments(parser)
@@ -16,6 +17,27 @@ if __name__ == "__main__":
 	# Parse cmd line args
 	args: dict = parser.parse_args().__dict__
 
+	# Parse playlist
+	playlist_file = args.pop("playlist")
+	if playlist_file is not None:
+		args.pop("cfg")
+		try:
+			playlist = FlowPlaylist.from_file(playlist_file, args)
+		except FileNotFoundError as e:
+			print("[Error] Target file `%s` could not be found" % e.filename)
+			quit()
+		except PermissionError as e:
+			print("[Error] No permission to access file `%s`" % e.filename)
+			quit()
+		except json.decoder.JSONDecodeError as e:
+			print("[Error] JSON playlist is not valid... Message : %s" % e)
+			quit()
+		except Exception as e:
+			print("[Error] An unknown error occurred... Message : %s" % e)
+			quit()
+		playlist.start()
+		quit()
+
 	# Parse json args
 	json_args: dict = {}
 	if args.get("cfg") is not None:
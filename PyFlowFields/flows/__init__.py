@@ -2,3 +2,6 @@ from PyFlowFields.flows.flow_lib import *
 from PyFlowFields.flows.flow_settings import *
 from PyFlowFields.flows.flow_utils import *
 from PyFlowFields.flows.perlin_noise_generator import *
+from PyFlowFields.flows.flow_governor import *
+from PyFlowFields.flows.flow_spatial import *
+from PyFlowFields.flows.flow_playlist import *
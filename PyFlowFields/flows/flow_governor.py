@@ -0,0 +1,117 @@
+import json
+import time
+
+
+class QualityGovernor:
+	"""
+	Keeps the frame cost within the simulation's frame budget by stepping through quality levels.
+	Each level simulates a smaller share of the population and regenerates the flow field less often.
+	Hysteresis : the scene degrades after `DEGRADE_FRAMES` frames over budget, but only recovers after
+	`RECOVER_FRAMES` frames well under budget, and no change happens during `COOLDOWN_FRAMES` after a switch.
+	"""
+
+	# (share of simulated particles, frames between each flow field update)
+	LEVELS = [
+		(1., 1),
+		(1., 2),
+		(.75, 2),
+		(.5, 4),
+		(.35, 4),
+		(.25, 8)
+	]
+
+	SMOOTHING = 0.1  # Weight of the last frame in the frame cost moving average
+	RECOVER_RATIO = 0.7  # Budget share under which the quality can be raised again
+	DEGRADE_FRAMES = 15
+	RECOVER_FRAMES = 90
+	COOLDOWN_FRAMES = 30
+
+	def __init__(self, target_fps: int):
+		"""
+		:param target_fps: Frame rate to hold, which sets the frame budget (must be a cap, i.e. > 0)
+		"""
+		if not target_fps or target_fps <= 0:
+			raise ValueError("The quality governor requires a frame rate to hold (fps > 0), got %s" % target_fps)
+		self.budget = 1 / target_fps  # seconds
+		self.level = 0
+		self.avg_cost = 0.
+		self.over_frames, self.under_frames, self.cooldown = 0, 0, 0
+		self.frame = 0
+		self.start_time = time.time()
+		self.log = []  # Every decision taken, for later export
+
+	def start(self):
+		"""
+		Reset the log clock, as the simulation may be built a while before it starts playing
+		"""
+		self.start_time = time.time()
+
+	@property
+	def particle_share(self) -> float:
+		return self.LEVELS[self.level][0]
+
+	@property
+	def field_interval(self) -> int:
+		return self.LEVELS[self.level][1]
+
+	def active_count(self, pop_size: int) -> int:
+		return int(pop_size * self.particle_share)
+
+	def update_field(self) -> bool:
+		"""
+		:return: Whether the flow field should be updated on the current frame
+		"""
+		return self.frame % self.field_interval == 0
+
+	def record(self, frame_cost: float) -> bool:
+		"""
+		:param frame_cost: Time spent computing and displaying the last frame (in seconds, excluding the fps cap wait)
+		:return: Whether the quality level changed
+		"""
+		self.frame += 1
+		self.avg_cost = frame_cost if self.frame == 1 else self.avg_cost + self.SMOOTHING * (frame_cost - self.avg_cost)
+
+		if self.cooldown > 0:
+			self.cooldown -= 1
+			return False
+
+		self.over_frames = self.over_frames + 1 if self.avg_cost > self.budget else 0
+		self.under_frames = self.under_frames + 1 if self.avg_cost < self.budget * self.RECOVER_RATIO else 0
+
+		if self.over_frames >= self.DEGRADE_FRAMES and self.level < len(self.LEVELS) - 1:
+			return self._set_level(self.level + 1, "over budget")
+		if self.under_frames >= self.RECOVER_FRAMES and self.level > 0:
+			return self._set_level(self.level - 1, "under budget")
+		return False
+
+	def _set_level(self, level: int, reason: str) -> bool:
+		self.log.append({
+			"time": round(time.time() - self.start_time, 3),
+			"frame": self.frame,
+			"from": self.level,
+			"to": level,
+			"reason": reason,
+			"avg_cost_ms": round(self.avg_cost * 1000, 3),
+			"budget_ms": round(self.budget * 1000, 3),
+			"particle_share": self.LEVELS[level][0],
+			"field_interval": self.LEVELS[level][1]
+		})
+		self.level = level
+		self.over_frames, self.under_frames = 0, 0
+		self.cooldown = self.COOLDOWN_FRAMES
+		return True
+
+	def debug_lines(self) -> list[str]:
+		lines = [
+			"Governor Level : %d / %d" % (self.level, len(self.LEVELS) - 1),
+			"Frame Cost : %5.1f / %5.1f ms" % (self.avg_cost * 1000, self.budget * 1000),
+			"Particles : %3.0f%%, Field : 1/%d frames" % (self.particle_share * 100, self.field_interval)
+		]
+		if self.log:
+			last = self.log[-1]
+			lines.append("Last Switch : %d -> %d (%s, %.1fs)" % (last["from"], last["to"], last["reason"], last["time"]))
+		return lines
+
+	def export(self, filename: str):
+		with open(filename, 'w') as log_file:
+			log_file.write(json.dumps(self.log, indent=4))
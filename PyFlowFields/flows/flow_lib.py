@@ -1,13 +1,21 @@
+import sys
 import json
 import time
+import itertools
+import queue
+import threading
 import pyperclip
 import numpy as np
 import pygame.display
 import matplotlib.pyplot as plt
 import PyFlowFields.flows.perlin_noise_generator as png
 
+from typing import Optional, Union
+from collections import OrderedDict
 from PyFlowFields.flows.flow_utils import *
 from PyFlowFields.flows.flow_settings import *
+from PyFlowFields.flows.flow_governor import QualityGovernor
+from PyFlowFields.flows.flow_spatial import SpatialGrid
 
 
 # TODO : JSON color functions
@@ -28,6 +36,8 @@ class FlowField:
 			for _ in range(settings.size.y)
 		]
 		self.noise = np.ndarray((1, 1))
+		self.fx = np.zeros((settings.size.y, settings.size.x), np.float32)  # Force x components, indexed [y][x]
+		self.fy = np.zeros((settings.size.y, settings.size.x), np.float32)  # Force y components, indexed [y][x]
 		self.update()
 
 	def randomize_seed(self, _update: bool = False):
@@ -67,44 +77,482 @@ class FlowField:
 			self.origin.x, self.origin.y,
 			self.settings.seed
 		)
+		self._set_angles(self.noise * self.settings.angle_range * (-1 if self.settings.inverted else 1))
+
+	def _set_angles(self, angles: np.ndarray):
+		"""
+		:param angles: Angle of each flow component (in degrees), indexed [y][x]
+		"""
+		self.fx = np.cos(np.radians(angles)).astype(np.float32)
+		self.fy = np.sin(np.radians(angles)).astype(np.float32)
 		for y, flow_line in enumerate(self.components):
 			for x, flow_el in enumerate(flow_line):
-				flow_el.set_angle(self.noise[y][x] * self.settings.angle_range * (-1 if self.settings.inverted else 1))
+				flow_el.set_angle(angles[y][x])
+
+	def force_at(self, x: int, y: int) -> Vector:
+		"""
+		:param x: Flow component column (out of range columns fall back to 0)
+		:param y: Flow component row (out of range rows fall back to 0)
+		:return: Unitary force vector of the flow component
+		"""
+		if not 0 <= x < self.settings.size.x:
+			x = 0
+		if not 0 <= y < self.settings.size.y:
+			y = 0
+		return self.components[y][x].force
+
+	def forces_at(self, xs: np.ndarray, ys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+		"""
+		Vectorized version of `force_at`
+		:param xs: Flow component columns (out of range columns fall back to 0)
+		:param ys: Flow component rows (out of range rows fall back to 0)
+		:return: Force components (fx, fy) for each given coordinate
+		"""
+		xs = np.where((xs >= 0) & (xs < self.settings.size.x), xs, 0)
+		ys = np.where((ys >= 0) & (ys < self.settings.size.y), ys, 0)
+		return self.fx[ys, xs], self.fy[ys, xs]
+
+	def _clip_cells(self, xs: np.ndarray, ys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+		"""
+		Clamp component coordinates on the field's edges before interpolating
+		"""
+		return np.clip(xs, 0, self.settings.size.x - 1), np.clip(ys, 0, self.settings.size.y - 1)
+
+	def sample_forces(self, xs: np.ndarray, ys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+		"""
+		Bilinear interpolation of the force components between the 4 closest flow component centers
+		:param xs: Columns (as floats, component x covers [x ; x + 1[)
+		:param ys: Rows (as floats, component y covers [y ; y + 1[)
+		:return: Interpolated force components (fx, fy) for each given coordinate
+		"""
+		return self._interpolate(xs - 0.5, ys - 0.5, self.forces_at)
+
+	def _interpolate(self, u: np.ndarray, v: np.ndarray, lookup: Callable) -> tuple[np.ndarray, np.ndarray]:
+		"""
+		:param u: Columns, relative to the flow component centers
+		:param v: Rows, relative to the flow component centers
+		:param lookup: Function returning the force components (fx, fy) of integer component coordinates
+		"""
+		x0, y0 = np.floor(u).astype(np.int64), np.floor(v).astype(np.int64)
+		tx, ty = (u - x0).astype(np.float32), (v - y0).astype(np.float32)
+		# Both corners get clamped, so that samples past the edge centers stick to the edge components
+		x1, y1 = self._clip_cells(x0 + 1, y0 + 1)
+		x0, y0 = self._clip_cells(x0, y0)
+
+		fx00, fy00 = lookup(x0, y0)
+		fx10, fy10 = lookup(x1, y0)
+		fx01, fy01 = lookup(x0, y1)
+		fx11, fy11 = lookup(x1, y1)
+		fx = (fx00 * (1 - tx) + fx10 * tx) * (1 - ty) + (fx01 * (1 - tx) + fx11 * tx) * ty
+		fy = (fy00 * (1 - tx) + fy10 * tx) * (1 - ty) + (fy01 * (1 - tx) + fy11 * tx) * ty
+		return fx, fy
 
 	def invert(self, update: bool):
 		self.settings.inverted = not self.settings.inverted
 		if update:
 			self.update()
 
-	def display(self, unit_size: int):
+	def close(self):
 		"""
-		:param unit_size: Length for each flow component
+		Release the resources held by this field once it isn't used anymore
 		"""
-		tex = np.ones(((self.settings.size.x + 2) * unit_size, (self.settings.size.y + 2) * unit_size), np.int16) * 255
-		for y, flow_line in enumerate(self.components):
-			for x, flow_el in enumerate(flow_line):
-				# Compute points belonging to the vector
-				points = np.linspace(
-					((x + 1) * unit_size, (y + 1) * unit_size),
-					((x + 1 + flow_el.force.x) * unit_size, (y + 1 + flow_el.force.y) * unit_size),
-					unit_size
-				)
-				# Draw vector
-				for point in points:
-					tex[int(point[1])][int(point[0])] = 0
+		pass
+
+	def view_forces(self) -> tuple[np.ndarray, np.ndarray]:
+		"""
+		:return: Force components (fx, fy) of the flow components covering the environment, indexed [y][x]
+		"""
+		return self.fx, self.fy
+
+	def render(self, unit_size: int, heatmap: bool = False) -> np.ndarray:
+		"""
+		Rasterize every flow component as an arrow, in a single vectorized pass
+		:param unit_size: Length for each flow component (in pixels)
+		:param heatmap: Color each component's cell by its angle
+		:return: RGB image (uint8), indexed [y][x], with a one component wide margin
+		"""
+		fx, fy = self.view_forces()
+		rows, cols = fx.shape
+		height, width = (rows + 2) * unit_size, (cols + 2) * unit_size
+
+		tex = np.full((height, width, 3), 255, np.uint8)
+		if heatmap:
+			cells = hue_array(np.degrees(np.arctan2(fy, fx)), 200)
+			tex[unit_size:-unit_size, unit_size:-unit_size] = cells.repeat(unit_size, axis=0).repeat(unit_size, axis=1)
+
+		# Arrow shaft from each component's top left corner, and two barbs at its tip
+		ys, xs = np.mgrid[1:rows + 1, 1:cols + 1] * unit_size
+		tips_x, tips_y = xs + fx * unit_size, ys + fy * unit_size
+		angles = np.arctan2(fy, fx)
+		segments = [(xs, ys, tips_x, tips_y)]
+		for barb in (math.radians(150), -math.radians(150)):
+			segments.append((tips_x, tips_y, tips_x + np.cos(angles + barb) * unit_size / 3, tips_y + np.sin(angles + barb) * unit_size / 3))
+
+		t = np.linspace(0, 1, max(2, unit_size))
+		for x0, y0, x1, y1 in segments:
+			px = x0.reshape(-1, 1) + (x1 - x0).reshape(-1, 1) * t
+			py = y0.reshape(-1, 1) + (y1 - y0).reshape(-1, 1) * t
+			tex[np.clip(py.astype(int), 0, height - 1), np.clip(px.astype(int), 0, width - 1)] = 0
+		return tex
+
+	def save_render(self, filename: str, unit_size: int, heatmap: bool = False):
+		"""
+		Write the field's rendering to an image file (format given by the extension), without opening any window
+		"""
+		pygame.image.save(pygame.surfarray.make_surface(self.render(unit_size, heatmap).swapaxes(0, 1)), filename)
 
+	def display(self, unit_size: int, heatmap: bool = False):
+		"""
+		:param unit_size: Length for each flow component
+		:param heatmap: Color each component's cell by its angle
+		"""
 		_, plots = plt.subplots(1, 2)
 
 		plots[0].title.set_text('Perlin Noise (seed=%d)' % self.settings.seed)
 		plots[0].imshow(self.noise, cmap='gray')
 		plots[1].title.set_text('Flow Field')
-		plots[1].imshow(tex, cmap='gray')
+		plots[1].imshow(self.render(unit_size, heatmap))
 
 		plt.show()
 
 
+class FlowLayer:
+	"""
+	Noise layer of a LayeredFlowField, caching its force grid until one of its inputs changes
+	"""
+
+	def __init__(self, settings: FlowFieldSettings):
+		self.settings = settings
+		if self.settings.seed <= 0:
+			self.settings.seed = random.randint(0, 0xFFFFFF)
+		self.origin = Vector.zero()
+		self.since_update = math.inf  # Time since the grid was last generated
+		self.key = None  # Inputs the cached grid was generated with
+		self.noise = np.zeros((settings.size.y, settings.size.x))
+
+	def update(self, dt: float, offset: Vector, fx: np.ndarray, fy: np.ndarray) -> bool:
+		"""
+		:param offset: Noise offset shared by every layer
+		:param fx: Where to write the force x components if they change
+		:param fy: Where to write the force y components if they change
+		:return: Whether the grid was regenerated
+		"""
+		self.origin += self.settings.offset_step * dt
+		self.since_update += dt
+		if self.settings.rate > 0 and self.since_update < 1 / self.settings.rate:
+			return False
+
+		key = (
+			self.settings.seed, self.settings.variation_level, self.settings.angle_range, self.settings.inverted,
+			self.origin.x + offset.x, self.origin.y + offset.y
+		)
+		if key == self.key:
+			return False
+
+		self.key = key
+		self.since_update = 0
+		self.noise = png.create(
+			self.settings.size.x, self.settings.size.y,
+			self.settings.variation_level,
+			self.origin.x + offset.x, self.origin.y + offset.y,
+			self.settings.seed
+		)
+		angles = np.radians(self.noise * self.settings.angle_range * (-1 if self.settings.inverted else 1))
+		fx[:] = np.cos(angles)
+		fy[:] = np.sin(angles)
+		return True
+
+
+class LayeredFlowField(FlowField):
+	"""
+	Flow field blending several noise layers (see `FlowFieldSettings.layers`) : each component points along the weighted
+	sum of the layers' unitary vectors. The field's own `offset_step` pans every layer at once.
+	"""
+
+	def __init__(self, settings: FlowFieldSettings):
+		if settings.chunk_size > 0:
+			raise ValueError("Layered flow fields can't be generated in tiles (`%s` and `%s` can't be combined)" % (FlowFieldSettings.ARG_LAYERS, FlowFieldSettings.ARG_CHUNK_SIZE))
+		self.layers = [FlowLayer(layer) for layer in settings.layers]
+		size = (len(self.layers), settings.size.y, settings.size.x)
+		self.layers_fx = np.zeros(size, np.float32)  # Cached force grids of every layer, indexed [layer][y][x]
+		self.layers_fy = np.zeros(size, np.float32)
+		if settings.seed <= 0:
+			settings.seed = random.randint(0, 0xFFFFFF)  # Keeps the layers' seeds when none was given to the whole field
+		super().__init__(settings)
+
+	def randomize_seed(self, _update: bool = False):
+		for layer in self.layers:
+			layer.settings.seed = random.randint(0, 0xFFFFFF)
+		super().randomize_seed(_update)
+
+	def invert(self, update: bool):
+		for layer in self.layers:
+			layer.settings.inverted = not layer.settings.inverted
+		super().invert(update)
+
+	def set_variation(self, zoom: float, update: bool = False):
+		"""
+		Scale every layer's variation level along with this field's, keeping their relative scales
+		"""
+		ratio = zoom / self.settings.variation_level
+		for layer in self.layers:
+			layer.settings.variation_level *= ratio
+		super().set_variation(zoom, update)
+
+	def update(self, dt: float = 0):
+		self.origin += self.settings.offset_step * dt
+		changed = False
+		for i, layer in enumerate(self.layers):
+			changed |= layer.update(dt, self.origin, self.layers_fx[i], self.layers_fy[i])
+		if not changed:
+			return
+
+		# Recombine every layer in a single pass
+		weights = np.array([layer.settings.weight for layer in self.layers], np.float32)
+		fx = np.tensordot(weights, self.layers_fx, axes=1)
+		fy = np.tensordot(weights, self.layers_fy, axes=1)
+		self.noise = np.tensordot(weights, np.stack([layer.noise for layer in self.layers]), axes=1) / max(1e-9, weights.sum())
+		self._set_angles(np.degrees(np.arctan2(fy, fx)))
+
+
+class ChunkedFlowField(FlowField):
+	"""
+	Unbounded flow field, generated on demand in square tiles of `chunk_size` flow components.
+	The field's origin acts as the view position over the noise world, and walks by `offset_step` every second.
+	Tiles ahead of the view (in its direction of motion) are generated in a background thread.
+	"""
+
+	def __init__(self, settings: FlowFieldSettings):
+		self.tiles = OrderedDict()  # (tile key) -> (fx, fy) arrays, least recently used first
+		self.tiles_lock = threading.Lock()
+		self.prefetch_queue = queue.Queue()  # Tile keys to generate, None stops the prefetch thread
+		self.prefetch_pending = set()
+		self.generating = set()  # Tile keys being generated by either thread
+		self.tile_ready = threading.Condition(self.tiles_lock)  # Notified when a tile is done generating
+		self.closed = False
+		self.prefetch_thread = threading.Thread(target=self._prefetch_loop, daemon=True)
+		self.prefetch_thread.start()
+
+		self.settings = settings
+		if self.settings.seed <= 0:
+			self.randomize_seed()
+		if 0 < self.settings.cache_size < self.min_cache_size:
+			print("[Info] Tile cache (%d tiles) is smaller than the view and its prefetch border, using %d tiles instead" % (self.settings.cache_size, self.min_cache_size))
+		self.origin = Vector.zero()  # View position over the noise world
+		self.update()
+
+	@property
+	def spacing(self) -> float:
+		"""
+		Noise distance between two neighboring flow components
+		"""
+		return self.settings.variation_level / self.settings.size.x
+
+	@property
+	def min_cache_size(self) -> int:
+		"""
+		Tile count covering the view at any alignment, along with a prefetch border on each side
+		"""
+		size = self.settings.chunk_size
+		return (math.ceil(self.settings.size.x / size) + 3) * (math.ceil(self.settings.size.y / size) + 3)
+
+	def _tile_key(self, tx: int, ty: int) -> tuple:
+		return (
+			tx, ty, self.settings.seed,
+			self.settings.variation_level, self.settings.angle_range, self.settings.inverted
+		)
+
+	def _generate_tile(self, key: tuple) -> tuple[np.ndarray, np.ndarray]:
+		tx, ty, seed, variation, angle_range, inverted = key
+		size = self.settings.chunk_size
+		spacing = variation / self.settings.size.x
+		noise = png.create(size, size, spacing * (size - 1), tx * size * spacing, ty * size * spacing, seed)
+		angles = np.radians(noise * angle_range * (-1 if inverted else 1))
+		return np.cos(angles).astype(np.float32), np.sin(angles).astype(np.float32)
+
+	def _store_tile(self, key: tuple, tile: tuple[np.ndarray, np.ndarray]):
+		with self.tiles_lock:
+			if self.closed:
+				return
+			self.tiles[key] = tile
+			self.tiles.move_to_end(key)
+			while len(self.tiles) > max(self.min_cache_size, self.settings.cache_size):
+				self.tiles.popitem(last=False)
+
+	def get_tile(self, tx: int, ty: int) -> tuple[np.ndarray, np.ndarray]:
+		"""
+		:return: Force components (fx, fy) of a tile, generated right away if it isn't cached yet
+		"""
+		key = self._tile_key(tx, ty)
+		with self.tiles_lock:
+			# Wait for the other thread rather than generating the same tile twice
+			while key in self.generating:
+				self.tile_ready.wait()
+			tile = self.tiles.get(key)
+			if tile is not None:
+				self.tiles.move_to_end(key)
+				return tile
+			self.generating.add(key)
+		try:
+			tile = self._generate_tile(key)
+			self._store_tile(key, tile)
+		finally:
+			with self.tiles_lock:
+				self.generating.discard(key)
+				self.tile_ready.notify_all()
+		return tile
+
+	def world_force(self, x: float, y: float) -> Vector:
+		"""
+		:param x: World column (in flow components, any value)
+		:param y: World row (in flow components, any value)
+		:return: Unitary force vector of the flow component at these coordinates
+		"""
+		size = self.settings.chunk_size
+		x, y = math.floor(x), math.floor(y)
+		fx, fy = self.get_tile(x // size, y // size)
+		return Vector(float(fx[y % size][x % size]), float(fy[y % size][x % size]))
+
+	def force_at(self, x: int, y: int) -> Vector:
+		"""
+		:param x: Column relative to the current view (any value)
+		:param y: Row relative to the current view (any value)
+		"""
+		return self.world_force(self.origin.x / self.spacing + x, self.origin.y / self.spacing + y)
+
+	def forces_at(self, xs: np.ndarray, ys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+		"""
+		Vectorized version of `force_at`
+		"""
+		wx = np.floor(self.origin.x / self.spacing + xs).astype(np.int64)
+		wy = np.floor(self.origin.y / self.spacing + ys).astype(np.int64)
+		return self.world_forces(wx, wy)
+
+	def world_forces(self, wx: np.ndarray, wy: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+		"""
+		Vectorized version of `world_force`
+		:param wx: World columns (integers)
+		:param wy: World rows (integers)
+		"""
+		size = self.settings.chunk_size
+		tx, ty = wx // size, wy // size
+		lx, ly = wx % size, wy % size
+		fx, fy = np.empty(len(wx), np.float32), np.empty(len(wy), np.float32)
+		if len(wx) == 0:
+			return fx, fy
+
+		# Group the coordinates by tile once, then gather each tile's run in a single fancy index
+		ids = (ty - ty.min()) * (tx.max() - tx.min() + 1) + (tx - tx.min())
+		order = np.argsort(ids, kind="stable")
+		bounds = np.concatenate(([0], np.flatnonzero(np.diff(ids[order])) + 1, [len(order)]))
+		for start, end in zip(bounds[:-1], bounds[1:]):
+			run = order[start:end]
+			tile_fx, tile_fy = self.get_tile(int(tx[run[0]]), int(ty[run[0]]))
+			fx[run] = tile_fx[ly[run], lx[run]]
+			fy[run] = tile_fy[ly[run], lx[run]]
+		return fx, fy
+
+	def sample_forces(self, xs: np.ndarray, ys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+		"""
+		Interpolated in world coordinates, so that samples follow the view's sub-component position
+		"""
+		u = self.origin.x / self.spacing + xs - 0.5
+		v = self.origin.y / self.spacing + ys - 0.5
+		return self._interpolate(u, v, self.world_forces)
+
+	def _clip_cells(self, xs: np.ndarray, ys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+		return xs, ys  # Unbounded
+
+	def update(self, dt: float = 0):
+		self.origin += self.settings.offset_step * dt
+
+		# Queue up tiles in view, along with the next ones in the direction of motion
+		size = self.settings.chunk_size
+		left, top = self.origin.x / self.spacing, self.origin.y / self.spacing
+		first_x, last_x = math.floor(left) // size, math.floor(left + self.settings.size.x) // size
+		first_y, last_y = math.floor(top) // size, math.floor(top + self.settings.size.y) // size
+		if self.settings.offset_step.x > 0:
+			last_x += 1
+		elif self.settings.offset_step.x < 0:
+			first_x -= 1
+		if self.settings.offset_step.y > 0:
+			last_y += 1
+		elif self.settings.offset_step.y < 0:
+			first_y -= 1
+
+		if self.closed:
+			return  # Tiles are only generated when sampled from now on
+		for ty in range(first_y, last_y + 1):
+			for tx in range(first_x, last_x + 1):
+				key = self._tile_key(tx, ty)
+				with self.tiles_lock:
+					if key in self.tiles or key in self.prefetch_pending:
+						continue
+					self.prefetch_pending.add(key)
+				self.prefetch_queue.put(key)
+
+	def _prefetch_loop(self):
+		while True:
+			key = self.prefetch_queue.get()
+			if key is None:
+				return
+			with self.tiles_lock:
+				if self.closed or key in self.tiles or key in self.generating:
+					self.prefetch_pending.discard(key)
+					continue
+				self.generating.add(key)
+			try:
+				self._store_tile(key, self._generate_tile(key))
+			finally:
+				with self.tiles_lock:
+					self.prefetch_pending.discard(key)
+					self.generating.discard(key)
+					self.tile_ready.notify_all()
+
+	def close(self):
+		"""
+		Stop the prefetch thread and drop the cached tiles
+		"""
+		if self.closed:
+			return
+		with self.tiles_lock:
+			self.closed = True
+		# Drop the queued tiles, then wait for the one being generated
+		while True:
+			try:
+				self.prefetch_queue.get_nowait()
+			except queue.Empty:
+				break
+		self.prefetch_queue.put(None)
+		self.prefetch_thread.join()
+		with self.tiles_lock:
+			self.tiles.clear()
+			self.prefetch_pending.clear()
+
+	def view_forces(self) -> tuple[np.ndarray, np.ndarray]:
+		ys, xs = np.mgrid[0:self.settings.size.y, 0:self.settings.size.x]
+		fx, fy = self.forces_at(xs.reshape(-1), ys.reshape(-1))
+		return fx.reshape(xs.shape), fy.reshape(xs.shape)
+
+	def display(self, unit_size: int, heatmap: bool = False):
+		plt.title('Flow Field (seed=%d)' % self.settings.seed)
+		plt.imshow(self.render(unit_size, heatmap))
+		plt.show()
+
+
 class Particle(Vector):
 
+	__slots__ = ("motion", "prev_pos", "skip_drawing")
+
+	@staticmethod
+	def estimate_size() -> int:
+		"""
+		:return: Approximate memory used by a single particle object (in bytes), including its reference in a list
+		"""
+		particle = Particle(1., 1.)
+		objects = [particle, particle.x, particle.y, particle.motion, particle.motion.x, particle.motion.y, particle.prev_pos]
+		return sum(sys.getsizeof(obj) for obj in objects) + 8
+
 	def __init__(self, x, y):
 		super().__init__(x, y)
 		self.motion = Vector.zero()
@@ -124,22 +572,16 @@ class Particle(Vector):
 
 		# Get closest flow element
 		ff_size = ff.settings.size
-		flow_coords = Vector(
+		flow_force = ff.force_at(
 			int(self.x * ff_size.x / env_size[0]),
 			int(self.y * ff_size.y / env_size[1])
 		)
-		if not 0 <= flow_coords.x < ff_size.x:
-			flow_coords.x = 0
-		if not 0 <= flow_coords.y < ff_size.y:
-			flow_coords.y = 0
-
-		flow_el = ff.components[flow_coords.y][flow_coords.x]
 
 		force_power = settings.flow_force
 		if settings.force_variation > 0 and settings.force_period > 0:
 			force_power += settings.force_variation * math.cos(math.pi * sim_time / settings.force_period)
 
-		self.motion += flow_el.force * force_power
+		self.motion += flow_force * force_power
 		if settings.force_max_speed or self.motion.length() > settings.max_speed:
 			self.motion.normalize()
 			self.motion *= settings.max_speed
@@ -152,34 +594,169 @@ class Particle(Vector):
 		deltaY = abs(self.y - self.prev_pos.y)
 		self.skip_drawing = deltaX >= 0.8 * env_size[0] or deltaY >= 0.8 * env_size[1]
 
-	def draw(self, env: pygame.Surface, sim_duration: float, settings: ParticleDrawingSettings):
+	def draw(self, env: pygame.Surface, sim_duration: float, settings: ParticleDrawingSettings) -> Optional[pygame.Rect]:
+		"""
+		:return: Bounding rectangle of the drawn shape (None if nothing was drawn)
+		"""
 		if self.skip_drawing:
-			return
+			return None
 
 		color = settings.color
 		if isinstance(color, Callable):
 			color = color(self, sim_duration)
 
 		if settings.draw_mode == ParticleDrawingSettings.MODE_LINEAR:
-			pygame.draw.line(env, color, (self.prev_pos.x, self.prev_pos.y), (self.x, self.y))
+			return pygame.draw.line(env, color, (self.prev_pos.x, self.prev_pos.y), (self.x, self.y))
 		elif settings.draw_mode == ParticleDrawingSettings.MODE_PARTICLE:
-			pygame.draw.circle(env, color, (self.x, self.y), settings.width)
+			return pygame.draw.circle(env, color, (self.x, self.y), settings.width)
 		elif settings.draw_mode == ParticleDrawingSettings.MODE_BLOC:
-			pygame.draw.rect(env, color, pygame.Rect(self.x - settings.width / 2, self.y - settings.width / 2, settings.width, settings.width))
+			return pygame.draw.rect(env, color, pygame.Rect(self.x - settings.width / 2, self.y - settings.width / 2, settings.width, settings.width))
 		elif settings.draw_mode == ParticleDrawingSettings.MODE_HOLLOW:
-			pygame.draw.circle(env, color, (self.x, self.y), settings.width, width=1)
+			return pygame.draw.circle(env, color, (self.x, self.y), settings.width, width=1)
 		elif settings.draw_mode == ParticleDrawingSettings.MODE_HOLLOW_BLOC:
-			pygame.draw.rect(env, color, pygame.Rect(self.x - settings.width / 2, self.y - settings.width / 2, settings.width, settings.width), width=1)
+			return pygame.draw.rect(env, color, pygame.Rect(self.x - settings.width / 2, self.y - settings.width / 2, settings.width, settings.width), width=1)
+
+
+
+class ParticleArray:
+	"""
+	Particle population stored in float32 arrays (one row per particle), updated in a single vectorized pass
+	"""
+
+	# Runge-Kutta integrators treat the flow force applied on each frame (see `Particle.update`) as an acceleration
+	# reaching the same motion after one frame at this rate, so that trajectories don't depend on the frame rate
+	REFERENCE_FPS = 60
+
+	def __init__(self, xs: np.ndarray, ys: np.ndarray):
+		self.pos = np.stack((xs, ys), axis=1).astype(np.float32)
+		self.prev_pos = np.zeros_like(self.pos)
+		self.motion = np.zeros_like(self.pos)
+		self.skip_drawing = np.zeros(len(self.pos), bool)
+		self.grid = SpatialGrid()  # Neighbor lookup for particle interactions
+
+	def __len__(self):
+		return len(self.pos)
+
+	@property
+	def bytes_per_particle(self) -> int:
+		return self.pos.itemsize * 2 * 3 + self.skip_drawing.itemsize
+
+	@property
+	def nbytes(self) -> int:
+		return self.pos.nbytes + self.prev_pos.nbytes + self.motion.nbytes + self.skip_drawing.nbytes
+
+	def update(self, env_size: tuple[int, int], ff: FlowField, dt: float, sim_time: float, settings: ParticleMovementSettings, count: int = None):
+		"""
+		Same as `Particle.update`, applied to the whole population at once
+		:param count: Only update the first `count` particles (all of them if None)
+		"""
+		pos, prev_pos, motion = self.pos[:count], self.prev_pos[:count], self.motion[:count]  # Views, updated in place
+		prev_pos[:] = pos
+
+		force_power = settings.flow_force
+		if settings.force_variation > 0 and settings.force_period > 0:
+			force_power += settings.force_variation * math.cos(math.pi * sim_time / settings.force_period)
+
+		if settings.integrator != ParticleMovementSettings.INTEGRATOR_EULER:
+			self._integrate(env_size, ff, dt, settings, force_power, pos, motion)
+			self._wrap(env_size, pos, prev_pos)
+			return
+
+		# Get closest flow elements
+		fx, fy = self._flow_forces(env_size, ff, pos, settings)
+		motion[:, 0] += fx * force_power
+		motion[:, 1] += fy * force_power
+		if settings.interaction_radius > 0:
+			motion += self.grid.interaction_forces(pos, env_size, settings).astype(np.float32)
+		self._cap_speed(motion, settings)
+
+		# Actually move the particles
+		pos += motion * dt
+		self._wrap(env_size, pos, prev_pos)
+
+	@staticmethod
+	def _flow_forces(env_size: tuple[int, int], ff: FlowField, pos: np.ndarray, settings: ParticleMovementSettings) -> tuple[np.ndarray, np.ndarray]:
+		"""
+		:return: Flow force components (fx, fy) at each position, as set by the sampling method
+		"""
+		ff_size = ff.settings.size
+		xs = pos[:, 0] % env_size[0] * (ff_size.x / env_size[0])
+		ys = pos[:, 1] % env_size[1] * (ff_size.y / env_size[1])
+		if settings.sampling == ParticleMovementSettings.SAMPLING_BILINEAR:
+			return ff.sample_forces(xs, ys)
+		return ff.forces_at(xs.astype(np.int64), ys.astype(np.int64))
+
+	@staticmethod
+	def _cap_speed(motion: np.ndarray, settings: ParticleMovementSettings):
+		length = np.hypot(motion[:, 0], motion[:, 1])
+		capped = (length > 0) & (settings.force_max_speed | (length > settings.max_speed))
+		motion[capped] *= (settings.max_speed / length[capped])[:, None]
 
+	def _wrap(self, env_size: tuple[int, int], pos: np.ndarray, prev_pos: np.ndarray):
+		np.mod(pos, np.array(env_size, np.float32), out=pos)
+		pos[pos[:, 0] >= env_size[0], 0] = 0  # float32 rounding can land exactly on the upper bound
+		pos[pos[:, 1] >= env_size[1], 1] = 0
+
+		delta = np.abs(pos - prev_pos)
+		self.skip_drawing[:len(pos)] = (delta[:, 0] >= 0.8 * env_size[0]) | (delta[:, 1] >= 0.8 * env_size[1])
+
+	def _integrate(self, env_size: tuple[int, int], ff: FlowField, dt: float, settings: ParticleMovementSettings, force_power: float, pos: np.ndarray, motion: np.ndarray):
+		"""
+		Runge-Kutta integration of the particles motion (RK2 midpoint or classic RK4) over `dt`
+		"""
+		if settings.interaction_radius > 0:
+			motion += self.grid.interaction_forces(pos, env_size, settings).astype(np.float32)
+
+		def derivatives(stage_pos: np.ndarray, stage_motion: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+			fx, fy = self._flow_forces(env_size, ff, stage_pos, settings)
+			acceleration = np.stack((fx, fy), axis=1) * (force_power * self.REFERENCE_FPS)
+			velocity = stage_motion.copy()
+			self._cap_speed(velocity, settings)
+			return velocity, acceleration
+
+		p0, m0 = pos.astype(np.float64), motion.astype(np.float64)
+		v1, a1 = derivatives(p0, m0)
+		if settings.integrator == ParticleMovementSettings.INTEGRATOR_RK2:
+			v2, a2 = derivatives(p0 + v1 * (dt / 2), m0 + a1 * (dt / 2))
+			new_pos, new_motion = p0 + v2 * dt, m0 + a2 * dt
+		else:
+			v2, a2 = derivatives(p0 + v1 * (dt / 2), m0 + a1 * (dt / 2))
+			v3, a3 = derivatives(p0 + v2 * (dt / 2), m0 + a2 * (dt / 2))
+			v4, a4 = derivatives(p0 + v3 * dt, m0 + a3 * dt)
+			new_pos = p0 + (v1 + 2 * v2 + 2 * v3 + v4) * (dt / 6)
+			new_motion = m0 + (a1 + 2 * a2 + 2 * a3 + a4) * (dt / 6)
+
+		self._cap_speed(new_motion, settings)
+		pos[:] = new_pos
+		motion[:] = new_motion
+
+	def draw(self, env: pygame.Surface, sim_duration: float, settings: ParticleDrawingSettings, count: int = None, track_rects: bool = False) -> list[pygame.Rect]:
+		"""
+		Draw each particle through `Particle.draw`, using a single particle object as a view over each row
+		:param count: Only draw the first `count` particles (all of them if None)
+		:param track_rects: Collect the bounding rectangles of the drawn shapes
+		:return: Bounding rectangles of the drawn shapes (empty if they aren't tracked)
+		"""
+		view = Particle(0, 0)
+		rects = []
+		for i in np.flatnonzero(~self.skip_drawing[:count]):
+			view.x, view.y = float(self.pos[i, 0]), float(self.pos[i, 1])
+			view.prev_pos.set_components(float(self.prev_pos[i, 0]), float(self.prev_pos[i, 1]))
+			view.motion.set_components(float(self.motion[i, 0]), float(self.motion[i, 1]))
+			rect = view.draw(env, sim_duration, settings)
+			if track_rects and rect is not None:
+				rects.append(rect)
+		return rects
 
 
 class FlowSimulation:
 
 	@staticmethod
-	def from_data(json_data: dict, cmd_data: dict = None):
+	def from_data(json_data: dict, cmd_data: dict = None, surface: pygame.Surface = None):
 		"""
 		:param json_data: Data extracted from a json file
 		:param cmd_data: Data extracted from the command line (will overwrite json data)
+		:param surface: Window opened by another simulation, to prepare this one for (see `take_over`)
 		"""
 		if cmd_data is None:
 			cmd_data = {}
@@ -197,30 +774,75 @@ class FlowSimulation:
 			ParticleSettings(
 				ParticleDrawingSettings(**filtered),
 				ParticleMovementSettings(**filtered)
-			)
+			),
+			surface
 		)
 
 	TEMP_DEBUG_TIME = 3  # seconds
 	DEBUG_TEXT_SIZE = 11  # px
 
+	DIRTY_MERGE_COUNT = 256  # Dirty rects above which they get merged into tiles
+	DIRTY_TILE_SIZE = 64  # px
+	DIRTY_MAX_COVERAGE = 0.5  # Screen ratio above which a full flip is cheaper
+
 	# PyGame Elements
 	surface: pygame.Surface = None
 	font: pygame.font.Font = None
 
 	# Simulation Body
 	flow_field: FlowField = None
-	particles: list[Particle] = []
+	particles: Union[list[Particle], ParticleArray] = []
+	bytes_per_particle = 0
 
 	# Simulation State
 	start_time, copy_seed_time = -1, -1
 	running, paused, debug_info = False, False, False
 	fps_history = []
-
-	def __init__(self, settings: SimulationSettings, ff_settings: FlowFieldSettings, particle_settings: ParticleSettings):
+	dirty_rects: Optional[list[pygame.Rect]] = None  # Areas drawn on during the previous frame (None: unknown)
+	governor: Optional[QualityGovernor] = None
+	field_dt = 0  # Time elapsed since the last flow field update
+	grid: SpatialGrid = None
+	finished = False  # Whether the last run ended because its duration elapsed
+	fade_from: Optional[pygame.Surface] = None  # Last frame of the previous simulation, faded out when taking over
+	fade_duration, fade_time = 0, 0
+
+	def __init__(self, settings: SimulationSettings, ff_settings: FlowFieldSettings, particle_settings: ParticleSettings, surface: pygame.Surface = None):
+		"""
+		:param surface: Window opened by another simulation. Nothing gets drawn on it until `take_over` is called,
+		so the simulation can be prepared in the background (the window is opened right away if None)
+		"""
 		self.settings = settings
-		self.flow_field = FlowField(ff_settings)
+		if ff_settings.layers:
+			self.flow_field = LayeredFlowField(ff_settings)
+		elif ff_settings.chunk_size > 0:
+			self.flow_field = ChunkedFlowField(ff_settings)
+		else:
+			self.flow_field = FlowField(ff_settings)
 		self.particle_settings = particle_settings
-		self._init()
+		if self.settings.governor:
+			self.governor = QualityGovernor(self.settings.fps)
+		self.grid = SpatialGrid()
+		if surface is None:
+			self._init()
+		else:
+			self.surface = surface
+			self.particles = self._create_particles(surface.get_size())
+
+	def take_over(self, previous: "FlowSimulation", crossfade: float = 0):
+		"""
+		Start displaying this simulation in the window of another one, prepared with its surface
+		:param previous: Simulation currently displayed
+		:param crossfade: Duration (in seconds) to fade out the previous simulation's last frame
+		"""
+		previous.close()
+		self.surface = previous.surface
+		self.font = previous.font
+		pygame.display.set_caption(self.settings.name)
+		if crossfade > 0:
+			self.fade_from = self.surface.copy()
+			self.fade_duration, self.fade_time = crossfade, 0
+		else:
+			self.clear_canvas()
 
 	def _init(self):
 		# Init PyGame window
@@ -237,20 +859,63 @@ class FlowSimulation:
 		self.font = pygame.font.SysFont("couriernew", self.DEBUG_TEXT_SIZE)
 
 		# Instantiate population
-		p_rdm = random.Random(self.settings.particle_seed)
-		width, height = self.surface.get_size()
-		self.particles = [Particle(p_rdm.randint(1, width), p_rdm.randint(1, height)) for _ in range(self.settings.pop_size)]
+		self.particles = self._create_particles(self.surface.get_size())
+
+	def _create_particles(self, env_size: tuple[int, int]) -> Union[list[Particle], ParticleArray]:
+		"""
+		Spawn the population, in compact storage if required by the settings or the memory budget
+		"""
+		budget = self.settings.memory_budget
+		compact = self.settings.compact
+		if not compact and self.particle_settings.physics.needs_arrays():
+			print("[Info] Interpolated sampling and Runge-Kutta integrators require compact storage, switching to it")
+			compact = True
+		if not compact and 0 < budget < Particle.estimate_size():
+			print("[Info] Particle objects (~%d bytes) exceed the memory budget (%d bytes), switching to compact storage" % (Particle.estimate_size(), budget))
+			compact = True
 
-	def clear_canvas(self):
-		self.surface.fill(self.settings.clear_color)
+		p_rdm = random.Random(self.settings.particle_seed)
+		width, height = env_size
+		if not compact:
+			self.bytes_per_particle = Particle.estimate_size()
+			return [Particle(p_rdm.randint(1, width), p_rdm.randint(1, height)) for _ in range(self.settings.pop_size)]
+
+		# Same random sequence as the object storage, without building intermediate python objects
+		coords = np.fromiter(
+			(p_rdm.randint(1, size) for _ in range(self.settings.pop_size) for size in (width, height)),
+			np.float32, count=2 * self.settings.pop_size
+		).reshape(-1, 2)
+		particles = ParticleArray(coords[:, 0], coords[:, 1])
+		self.bytes_per_particle = particles.bytes_per_particle
+		if 0 < budget < self.bytes_per_particle:
+			raise ValueError("Memory budget of %d bytes per particle is below the compact storage size (%d bytes)" % (budget, self.bytes_per_particle))
+		return particles
+
+	def clear_canvas(self, rects: list[pygame.Rect] = None):
+		"""
+		:param rects: Areas to clear (the whole canvas is cleared if None)
+		"""
+		if rects is None:
+			self.surface.fill(self.settings.clear_color)
+			return
+		for rect in rects:
+			self.surface.fill(self.settings.clear_color, rect)
 
-	def start_sim(self):
+	def start_sim(self, duration: float = None):
+		"""
+		:param duration: Run for this many seconds (pauses excluded) then return, leaving the window open
+		for another simulation to take over (None : run until the user quits)
+		"""
 		self.start_time = time.time()
 		self.running = True
+		self.finished = False
+		if self.governor is not None:
+			self.governor.start()
 		clock = pygame.time.Clock()
 
 		while self.running:
 			dt = actual_dt = clock.tick(self.settings.fps) / 1000
+			frame_start = time.perf_counter()
 
 			# Poll events
 			for event in pygame.event.get():
@@ -263,29 +928,159 @@ class FlowSimulation:
 				dt = 0
 				self.start_time += actual_dt
 
-			# Clear canvas
-			temp_layer = pygame.Surface(self.surface.get_size(), pygame.SRCALPHA)
-			if self.settings.clear_each_frame:
-				temp_layer = self.surface
-				self.clear_canvas()
+			self.step(dt, time.time() - self.start_time, actual_dt)
 
-			self.flow_field.update(dt)
+			if self.governor is not None:
+				self.governor.record(time.perf_counter() - frame_start)
 
-			# Update particles
-			sim_time = time.time() - self.start_time
-			for particle in self.particles:
+			if duration is not None and time.time() - self.start_time >= duration:
+				self.running = False
+				self.finished = True
+
+		if self.governor is not None and self.settings.governor_log:
+			self.governor.export(self.settings.governor_log)
+		if not self.finished:
+			self.close()
+			pygame.quit()
+
+	def close(self):
+		"""
+		Release the resources held by the simulation body (the window is left untouched)
+		"""
+		self.flow_field.close()
+
+	def step(self, dt: float, sim_time: float, actual_dt: float = None):
+		"""
+		Compute and display a single frame
+		:param dt: Delta time for physics calculation (0 while paused)
+		:param sim_time: Time since the simulation started
+		:param actual_dt: Time elapsed since the previous frame, paused or not (`dt` if None)
+		"""
+		if actual_dt is None:
+			actual_dt = dt
+
+		# Dirty rects are only tracked when nothing else (i.e. the debug overlay or a crossfade) is drawn on the surface
+		track_rects = self.settings.dirty_rects and not self.debug_info and self.fade_from is None
+		if not track_rects:
+			self.dirty_rects = None
+
+		# Clear canvas
+		temp_layer = pygame.Surface(self.surface.get_size(), pygame.SRCALPHA)
+		if self.settings.clear_each_frame:
+			temp_layer = self.surface
+			if track_rects and self.dirty_rects is not None:
+				self.clear_canvas(self.dirty_rects)
+			else:
+				self.clear_canvas()
+
+		self.field_dt += dt
+		if self.governor is None or self.governor.update_field():
+			self.flow_field.update(self.field_dt)
+			self.field_dt = 0
+
+		# Update particles
+		count = len(self.particles) if self.governor is None else self.governor.active_count(len(self.particles))
+		drawn_rects = []
+		if isinstance(self.particles, ParticleArray):
+			self.particles.update(temp_layer.get_size(), self.flow_field, dt, sim_time, self.particle_settings.physics, count)
+			drawn_rects = self.particles.draw(temp_layer, sim_time, self.particle_settings.design, count, track_rects)
+		else:
+			if self.particle_settings.physics.interaction_radius > 0:
+				self._apply_interactions(temp_layer.get_size(), count)
+			for particle in itertools.islice(self.particles, count):
 				particle.update(temp_layer.get_size(), self.flow_field, dt, sim_time, self.particle_settings.physics)
-				particle.draw(temp_layer, sim_time, self.particle_settings.design)
+				rect = particle.draw(temp_layer, sim_time, self.particle_settings.design)
+				if track_rects and rect is not None:
+					drawn_rects.append(rect)
+
+		if not self.settings.clear_each_frame:
+			# Draw on the actual surface and apply transparency
+			self.surface.blit(temp_layer, temp_layer.get_rect())
 
-			if not self.settings.clear_each_frame:
-				# Draw on the actual surface and apply transparency
-				self.surface.blit(temp_layer, temp_layer.get_rect())
+		if self.fade_from is not None:
+			self._crossfade(actual_dt)
 
-			if self.debug_info:
-				self._debug_all(1 / actual_dt)
+		if self.debug_info:
+			self._debug_all(1 / actual_dt)
 
+		if track_rects and self.dirty_rects is not None:
+			self._update_display(self.dirty_rects or [], drawn_rects)
+		else:
 			pygame.display.flip()
-		pygame.quit()
+		if track_rects:
+			self.dirty_rects = drawn_rects
+
+	def _crossfade(self, dt: float):
+		"""
+		Fade out the previous simulation's last frame over this one
+		"""
+		self.fade_time += dt
+		if self.fade_time >= self.fade_duration:
+			self.fade_from = None
+			return
+
+		if self.settings.clear_each_frame:
+			# The canvas is cleared on every frame : overlay the previous frame, more transparent every time
+			self.fade_from.set_alpha(int(255 * (1 - self.fade_time / self.fade_duration)))
+			self.surface.blit(self.fade_from, (0, 0))
+		else:
+			# The canvas started from the previous frame : cover it with the background, down to ~1% by the end
+			veil = pygame.Surface(self.surface.get_size())
+			veil.fill(self.settings.clear_color)
+			veil.set_alpha(int(255 * (1 - 0.01 ** (dt / self.fade_duration))))
+			self.surface.blit(veil, (0, 0))
+
+	def _apply_interactions(self, env_size: tuple[int, int], count: int):
+		"""
+		Add neighbor forces to the motion of the first `count` particle objects
+		"""
+		particles = self.particles[:count]
+		pos = np.array([(particle.x, particle.y) for particle in particles], np.float64).reshape(-1, 2)
+		forces = self.grid.interaction_forces(pos, env_size, self.particle_settings.physics)
+		for particle, (fx, fy) in zip(particles, forces.tolist()):
+			particle.motion.x += fx
+			particle.motion.y += fy
+
+	def _update_display(self, prev_rects: list[pygame.Rect], drawn_rects: list[pygame.Rect]):
+		"""
+		Push to the display the areas modified during this frame (erased and newly drawn)
+		:param prev_rects: Areas drawn on during the previous frame (and cleared during this one)
+		:param drawn_rects: Areas drawn on during this frame
+		"""
+		rects = prev_rects + drawn_rects if self.settings.clear_each_frame else drawn_rects
+		if len(rects) > self.DIRTY_MERGE_COUNT:
+			rects = self._merge_rects(rects)
+
+		screen = self.surface.get_rect()
+		covered = sum(rect.clip(screen).width * rect.clip(screen).height for rect in rects)
+		if covered > self.DIRTY_MAX_COVERAGE * screen.width * screen.height:
+			pygame.display.flip()
+		else:
+			pygame.display.update(rects)
+
+	def _merge_rects(self, rects: list[pygame.Rect]) -> list[pygame.Rect]:
+		"""
+		Snap rectangles to a grid of DIRTY_TILE_SIZE tiles, and join adjacent tiles on each row
+		:return: Non overlapping rectangles covering at least the given ones
+		"""
+		size = self.DIRTY_TILE_SIZE
+		tiles = set()
+		for rect in rects:
+			for ty in range(rect.top // size, (rect.bottom - 1) // size + 1):
+				for tx in range(rect.left // size, (rect.right - 1) // size + 1):
+					tiles.add((tx, ty))
+
+		merged = []
+		run_start = prev = None
+		for tile in sorted(tiles, key=lambda t: (t[1], t[0])):
+			if prev is None or tile[1] != prev[1] or tile[0] != prev[0] + 1:
+				if run_start is not None:
+					merged.append(pygame.Rect(run_start[0] * size, run_start[1] * size, (prev[0] - run_start[0] + 1) * size, size))
+				run_start = tile
+			prev = tile
+		if run_start is not None:
+			merged.append(pygame.Rect(run_start[0] * size, run_start[1] * size, (prev[0] - run_start[0] + 1) * size, size))
+		return merged
 
 	def _handle_key_event(self, event: pygame.event.Event):
 		if event.key == pygame.K_q:
@@ -306,12 +1101,18 @@ class FlowSimulation:
 			save_file("Save flow simulation settings...", json.dumps(self.serialize(), indent=4), "json")
 		elif event.key == pygame.K_BACKSPACE:
 			self.clear_canvas()
+			self.dirty_rects = None
 
 	def _debug_all(self, fps: float):
 		self.fps_history.append(fps)
 		if len(self.fps_history) > 100:
 			self.fps_history = self.fps_history[1:]
 
+		governor_lines = []
+		if self.governor is not None:
+			governor_lines = self.governor.debug_lines()
+			governor_lines[0] = [governor_lines[0], 1.5]
+
 		contents = [
 			"--> Debug Information <--",
 
@@ -323,7 +1124,9 @@ class FlowSimulation:
 			["Sim Time : %5.2f" % (time.time() - self.start_time), 1.5],
 			"Sim Status : %s" % ("paused" if self.paused else "running"),
 			"Sim Population : %d" % self.settings.pop_size,
+			"Memory / Particle : %d bytes%s" % (self.bytes_per_particle, " (compact)" if isinstance(self.particles, ParticleArray) else ""),
 			"Sim Size : %d x %d" % self.surface.get_size(),
+			*governor_lines,
 
 			["FlowField Seed : %d" % self.flow_field.settings.seed, 1.5],
 			"Particle Seed : %d" % self.settings.particle_seed,
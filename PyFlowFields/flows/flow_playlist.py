@@ -0,0 +1,109 @@
+import os
+import json
+import pygame
+import threading
+
+from PyFlowFields.flows.flow_lib import FlowSimulation
+
+
+class FlowPlaylist:
+	"""
+	Plays several simulations one after the other in a single window.
+	While a scene plays, the next one (flow field and particles) is prepared in a background thread.
+	Window settings (fullscreen, screen size) are taken from the first scene.
+	"""
+
+	ARG_SCENES = "scenes"
+	ARG_CROSSFADE = "crossfade"
+	ARG_LOOP = "loop"
+
+	ARG_CFG = "cfg"
+	ARG_DURATION = "duration"
+
+	DEFAULT_DURATION = 30  # seconds
+
+	@staticmethod
+	def from_file(filename: str, cmd_data: dict = None):
+		"""
+		:param filename: JSON playlist, either a list of scenes or an object holding `scenes`, `crossfade` and `loop`.
+		Each scene holds a `cfg` (path to a JSON config, relative to the playlist, or the config itself) and a `duration`
+		:param cmd_data: Data extracted from the command line (will overwrite every scene's data)
+		"""
+		with open(filename, 'r') as playlist_file:
+			data = json.loads(playlist_file.read())
+		if isinstance(data, list):
+			data = {FlowPlaylist.ARG_SCENES: data}
+
+		scenes = []
+		for scene in data.get(FlowPlaylist.ARG_SCENES, []):
+			cfg = scene.get(FlowPlaylist.ARG_CFG, {})
+			if isinstance(cfg, str):
+				with open(os.path.join(os.path.dirname(filename), cfg), 'r') as cfg_file:
+					cfg = json.loads(cfg_file.read())
+			scenes.append((cfg, scene.get(FlowPlaylist.ARG_DURATION, FlowPlaylist.DEFAULT_DURATION)))
+
+		return FlowPlaylist(
+			scenes,
+			data.get(FlowPlaylist.ARG_CROSSFADE, 0),
+			data.get(FlowPlaylist.ARG_LOOP, True),
+			cmd_data
+		)
+
+	def __init__(self, scenes: list[tuple[dict, float]], crossfade: float = 0, loop: bool = True, cmd_data: dict = None):
+		"""
+		:param scenes: (simulation data, duration in seconds) for each scene, as given to `FlowSimulation.from_data`
+		:param crossfade: Duration (in seconds) of the transition between two scenes (0 for a hard cut)
+		:param loop: Start over after the last scene
+		:param cmd_data: Data extracted from the command line (will overwrite every scene's data)
+		"""
+		if not scenes:
+			raise ValueError("A playlist requires at least one scene")
+		self.scenes = scenes
+		self.crossfade = crossfade
+		self.loop = loop
+		self.cmd_data = cmd_data
+
+	def _build(self, index: int, surface=None) -> FlowSimulation:
+		return FlowSimulation.from_data(dict(self.scenes[index][0]), self.cmd_data, surface)
+
+	def start(self):
+		index = 0
+		sim = self._build(index)
+		while True:
+			next_index = index + 1
+			if next_index >= len(self.scenes):
+				next_index = 0 if self.loop else None
+
+			# Prepare the next scene while the current one plays
+			prepared = {}
+			worker = None
+			if next_index is not None:
+				def prepare(i=next_index, surface=sim.surface):
+					try:
+						prepared["sim"] = self._build(i, surface)
+					except Exception as e:
+						prepared["error"] = e
+				worker = threading.Thread(target=prepare, daemon=True)
+				worker.start()
+
+			sim.start_sim(self.scenes[index][1])
+			if not sim.finished:
+				# The user quit
+				if worker is not None:
+					worker.join()
+					if "sim" in prepared:
+						prepared["sim"].close()
+				return
+
+			if worker is None:
+				sim.close()
+				pygame.quit()
+				return
+
+			worker.join()
+			if "error" in prepared:
+				sim.close()
+				pygame.quit()
+				raise prepared["error"]
+			prepared["sim"].take_over(sim, self.crossfade)
+			sim, index = prepared["sim"], next_index
@@ -15,6 +15,11 @@ class SimulationSettings:
 	ARG_FPS = "fps"
 	ARG_FULLSCREEN = "fullscreen"
 	ARG_CLEAR_FRAME = "clear"
+	ARG_DIRTY_RECTS = "dirty"
+	ARG_COMPACT = "compact"
+	ARG_MEMORY_BUDGET = "pbudget"
+	ARG_GOVERNOR = "governor"
+	ARG_GOVERNOR_LOG = "governorlog"
 
 	@staticmethod
 	def add_arguments(parser: argparse.ArgumentParser):
@@ -27,6 +32,11 @@ class SimulationSettings:
 		group.add_argument("-%s" % SimulationSettings.ARG_FPS, help="Max FPS for the simulation", type=int, metavar=("fps"))
 		group.add_argument("--%s" % SimulationSettings.ARG_FULLSCREEN, help="Display the simulation fullscreen", action=argparse.BooleanOptionalAction)
 		group.add_argument("--%s" % SimulationSettings.ARG_CLEAR_FRAME, help="Clear the canvas on each frame", action=argparse.BooleanOptionalAction)
+		group.add_argument("--%s" % SimulationSettings.ARG_DIRTY_RECTS, help="Only redraw screen areas touched by particles", action=argparse.BooleanOptionalAction)
+		group.add_argument("--%s" % SimulationSettings.ARG_COMPACT, help="Store particles in float32 arrays", action=argparse.BooleanOptionalAction)
+		group.add_argument("-%s" % SimulationSettings.ARG_MEMORY_BUDGET, help="Max memory per particle (in bytes, 0 for no limit)", type=int, metavar=("bytes"))
+		group.add_argument("--%s" % SimulationSettings.ARG_GOVERNOR, help="Lower the simulation quality when frames exceed the fps budget (requires fps > 0)", action=argparse.BooleanOptionalAction)
+		group.add_argument("-%s" % SimulationSettings.ARG_GOVERNOR_LOG, help="Export quality governor decisions to a .json file on exit", type=str, metavar=("filename"))
 
 	def __init__(self, **kwargs):
 		self.name = kwargs.get(self.ARG_NAME, "FlowField Simulation")  # Name for the sim window
@@ -38,6 +48,15 @@ class SimulationSettings:
 		self.clear_each_frame = kwargs.get(self.ARG_CLEAR_FRAME, True)  # Clear the frame on each frame
 		self.clear_color = kwargs.get(self.ARG_BACKGROUND, [0, 0, 0])  # Background color
 		self.fps = kwargs.get(self.ARG_FPS, 60)
+		# Only clear and push to the display the areas particles were drawn on (instead of a full flip)
+		self.dirty_rects = kwargs.get(self.ARG_DIRTY_RECTS, False)
+		# Store particles in float32 arrays instead of one python object each
+		self.compact = kwargs.get(self.ARG_COMPACT, False)
+		# Max bytes per particle, compact storage is used when objects don't fit (0 : no limit)
+		self.memory_budget = kwargs.get(self.ARG_MEMORY_BUDGET, 0)
+		# Adjust the simulated particle count and flow field update rate to hold the target fps
+		self.governor = kwargs.get(self.ARG_GOVERNOR, False)
+		self.governor_log = kwargs.get(self.ARG_GOVERNOR_LOG, None)  # File to export the governor decisions to
 
 	def serialize(self):
 		return {
@@ -48,7 +67,12 @@ class SimulationSettings:
 			self.ARG_PARTICLE_SEED: self.particle_seed,
 			self.ARG_CLEAR_FRAME: self.clear_each_frame,
 			self.ARG_BACKGROUND: self.clear_color,
-			self.ARG_FPS: self.fps
+			self.ARG_FPS: self.fps,
+			self.ARG_DIRTY_RECTS: self.dirty_rects,
+			self.ARG_COMPACT: self.compact,
+			self.ARG_MEMORY_BUDGET: self.memory_budget,
+			self.ARG_GOVERNOR: self.governor,
+			self.ARG_GOVERNOR_LOG: self.governor_log
 		}
 
 
@@ -60,6 +84,11 @@ class FlowFieldSettings:
 	ARG_SEED = "fseed"
 	ARG_STEP = "fstep"
 	ARG_INVERTED = "finverted"
+	ARG_CHUNK_SIZE = "fchunk"
+	ARG_CACHE_SIZE = "fcache"
+	ARG_WEIGHT = "fweight"
+	ARG_RATE = "frate"
+	ARG_LAYERS = "flayers"
 
 	@staticmethod
 	def add_arguments(parser: argparse.ArgumentParser):
@@ -70,6 +99,8 @@ class FlowFieldSettings:
 		group.add_argument("-%s" % FlowFieldSettings.ARG_SEED, help="Seed used to compute vector directions", type=int, metavar=("seed"))
 		group.add_argument("-%s" % FlowFieldSettings.ARG_STEP, help="Noise offset to walk each second", type=float, action="extend", nargs=2, metavar=("x", "y"))
 		group.add_argument("--%s" % FlowFieldSettings.ARG_INVERTED, help="Invert vector directions", action=argparse.BooleanOptionalAction)
+		group.add_argument("-%s" % FlowFieldSettings.ARG_CHUNK_SIZE, help="Generate an unbounded field in tiles of this size (0 to disable)", type=int, metavar=("size"))
+		group.add_argument("-%s" % FlowFieldSettings.ARG_CACHE_SIZE, help="Max tile count kept in memory for an unbounded field", type=int, metavar=("count"))
 
 	def __init__(self, **kwargs):
 		self.size = Vector(*kwargs.get(self.ARG_SIZE, [30, 30]))
@@ -78,25 +109,71 @@ class FlowFieldSettings:
 		self.seed = kwargs.get(self.ARG_SEED, -1)
 		self.inverted = kwargs.get(self.ARG_INVERTED, False)
 		self.offset_step = Vector(*kwargs.get(self.ARG_STEP, [0, 0]))
+		# Tile size (in flow components) for an unbounded field generated on demand (0 : single fixed size grid)
+		self.chunk_size = kwargs.get(self.ARG_CHUNK_SIZE, 0)
+		# Max tile count kept in the unbounded field cache (least recently used tiles get discarded first)
+		# It is raised to at least the tiles covering the view along with a prefetch border
+		self.cache_size = kwargs.get(self.ARG_CACHE_SIZE, 64)
+		# Weight of this field when blended as a layer of another one
+		self.weight = kwargs.get(self.ARG_WEIGHT, 1)
+		# Max noise regenerations per second when blended as a layer of another one (0 : on every update)
+		self.rate = kwargs.get(self.ARG_RATE, 0)
+		# Noise layers blended into this field (JSON only), each layer defaults to this field's settings
+		# but its seed and step (this field's step already pans every layer), and tiling which layers don't support
+		layer_defaults = {k: v for k, v in kwargs.items() if k not in (
+			self.ARG_SEED, self.ARG_STEP, self.ARG_LAYERS, self.ARG_WEIGHT, self.ARG_RATE, self.ARG_CHUNK_SIZE, self.ARG_CACHE_SIZE
+		)}
+		self.layers = [
+			FlowFieldSettings(**{**layer_defaults, **layer, self.ARG_SIZE: self.size.get_components()})
+			for layer in kwargs.get(self.ARG_LAYERS, [])
+		]
 
 	def serialize(self):
-		return {
+		data = {
 			self.ARG_SIZE: self.size.get_components(),
 			self.ARG_VARIATION: self.variation_level,
 			self.ARG_RANGE: self.angle_range,
 			self.ARG_SEED: self.seed,
 			self.ARG_INVERTED: self.inverted,
-			self.ARG_STEP: self.offset_step.get_components()
+			self.ARG_STEP: self.offset_step.get_components(),
+			self.ARG_CHUNK_SIZE: self.chunk_size,
+			self.ARG_CACHE_SIZE: self.cache_size
+		}
+		if self.layers:
+			data[self.ARG_LAYERS] = [layer.serialize_layer() for layer in self.layers]
+		return data
+
+	def serialize_layer(self):
+		return {
+			self.ARG_VARIATION: self.variation_level,
+			self.ARG_RANGE: self.angle_range,
+			self.ARG_SEED: self.seed,
+			self.ARG_INVERTED: self.inverted,
+			self.ARG_STEP: self.offset_step.get_components(),
+			self.ARG_WEIGHT: self.weight,
+			self.ARG_RATE: self.rate
 		}
 
 
 class ParticleMovementSettings:
 
+	SAMPLING_NEAREST = 0
+	SAMPLING_BILINEAR = 1
+
+	INTEGRATOR_EULER = 0
+	INTEGRATOR_RK2 = 1
+	INTEGRATOR_RK4 = 2
+
 	ARG_FORCE = "pforce"
 	ARG_VARIATION = "pvar"
 	ARG_PERIOD = "pperiod"
 	ARG_MAX_SPEED = "pmaxspeed"
 	ARG_FORCE_SPEED = "pforcespeed"
+	ARG_RADIUS = "pradius"
+	ARG_SEPARATION = "pseparation"
+	ARG_COHESION = "pcohesion"
+	ARG_SAMPLING = "psampling"
+	ARG_INTEGRATOR = "pintegrator"
 
 	@staticmethod
 	def add_arguments(parser: argparse.ArgumentParser):
@@ -106,6 +183,11 @@ class ParticleMovementSettings:
 		group.add_argument("-%s" % ParticleMovementSettings.ARG_PERIOD, help="Time period for flow field oscillations (in seconds)", type=float, metavar=("duration"))
 		group.add_argument("-%s" % ParticleMovementSettings.ARG_MAX_SPEED, help="Max speed for particles (in px/s)", type=float, metavar=("speed"))
 		group.add_argument("--%s" % ParticleMovementSettings.ARG_FORCE_SPEED, help="Force particles to go at max speed", action=argparse.BooleanOptionalAction)
+		group.add_argument("-%s" % ParticleMovementSettings.ARG_RADIUS, help="Distance under which particles interact with each other (in px, 0 to disable)", type=float, metavar=("radius"))
+		group.add_argument("-%s" % ParticleMovementSettings.ARG_SEPARATION, help="Repulsion between neighboring particles", type=float, metavar=("force"))
+		group.add_argument("-%s" % ParticleMovementSettings.ARG_COHESION, help="Attraction between neighboring particles", type=float, metavar=("force"))
+		group.add_argument("-%s" % ParticleMovementSettings.ARG_SAMPLING, help="Flow field sampling method (0: Nearest, 1: Bilinear)", choices=[0, 1], type=int, metavar=("mode"))
+		group.add_argument("-%s" % ParticleMovementSettings.ARG_INTEGRATOR, help="Motion integration method (0: Euler, 1: RK2, 2: RK4)", choices=[0, 1, 2], type=int, metavar=("method"))
 
 	def __init__(self, **kwargs):
 		# How much a flow's force is impactful at any point on this particle
@@ -118,6 +200,22 @@ class ParticleMovementSettings:
 		self.max_speed = kwargs.get(self.ARG_MAX_SPEED, 300)
 		# Force particles to go at max speed at any time during the simulation
 		self.force_max_speed = kwargs.get(self.ARG_FORCE_SPEED, False)
+		# Distance under which particles push (separation) and pull (cohesion) each other (0 : no interactions)
+		self.interaction_radius = kwargs.get(self.ARG_RADIUS, 0)
+		# Repulsion force between two particles, highest when they overlap and fading out at the interaction radius
+		self.separation = kwargs.get(self.ARG_SEPARATION, 1)
+		# Attraction force between two particles, growing with their distance up to the interaction radius
+		self.cohesion = kwargs.get(self.ARG_COHESION, 0)
+		# How the flow force is read from the field (closest component, or interpolated between the 4 closest ones)
+		self.sampling = kwargs.get(self.ARG_SAMPLING, self.SAMPLING_NEAREST)
+		# How motion is integrated over a frame (Runge-Kutta methods keep trajectories smooth at low fps)
+		self.integrator = kwargs.get(self.ARG_INTEGRATOR, self.INTEGRATOR_EULER)
+
+	def needs_arrays(self) -> bool:
+		"""
+		:return: Whether these settings are only supported by the compact (array) particle storage
+		"""
+		return self.sampling != self.SAMPLING_NEAREST or self.integrator != self.INTEGRATOR_EULER
 
 	def serialize(self):
 		return {
@@ -125,7 +223,12 @@ class ParticleMovementSettings:
 			self.ARG_VARIATION: self.force_variation,
 			self.ARG_PERIOD: self.force_period,
 			self.ARG_MAX_SPEED: self.max_speed,
-			self.ARG_FORCE_SPEED: self.force_max_speed
+			self.ARG_FORCE_SPEED: self.force_max_speed,
+			self.ARG_RADIUS: self.interaction_radius,
+			self.ARG_SEPARATION: self.separation,
+			self.ARG_COHESION: self.cohesion,
+			self.ARG_SAMPLING: self.sampling,
+			self.ARG_INTEGRATOR: self.integrator
 		}
 
 
@@ -0,0 +1,84 @@
+import numpy as np
+
+from PyFlowFields.flows.flow_settings import ParticleMovementSettings
+
+
+class SpatialGrid:
+	"""
+	Uniform spatial hash grid over a wrapping environment, rebuilt from the particle positions on each frame.
+	Cells are at least `radius` wide, so every neighbor within the radius lies in one of the 3x3 surrounding cells.
+	"""
+
+	def __init__(self):
+		self.cols, self.rows = 1, 1
+		self.counts = np.zeros(1, np.int64)  # Particle count in each cell
+		self.starts = np.zeros(1, np.int64)  # Index in `order` of each cell's first particle
+		self.order = np.zeros(0, np.int64)  # Particle indices sorted by cell
+		self.cells = np.zeros((0, 2), np.int64)  # (column, row) of each particle
+
+	def build(self, pos: np.ndarray, env_size: tuple[int, int], radius: float):
+		"""
+		Sort the particles by cell: counts and starts come from a histogram, and the order from a radix sort
+		over 16 bits digits of the cell ids (NumPy's stable sort of 16 bits integers is a radix sort)
+		:param pos: Particle positions, one (x, y) row per particle
+		:param env_size: Environment size (positions wrap around it)
+		:param radius: Interaction radius, lower bound for the cell size
+		"""
+		self.cols = max(1, int(env_size[0] // radius))
+		self.rows = max(1, int(env_size[1] // radius))
+		self.cells = np.empty((len(pos), 2), np.int64)
+		self.cells[:, 0] = np.clip((pos[:, 0] * (self.cols / env_size[0])).astype(np.int64), 0, self.cols - 1)
+		self.cells[:, 1] = np.clip((pos[:, 1] * (self.rows / env_size[1])).astype(np.int64), 0, self.rows - 1)
+
+		ids = self.cells[:, 1] * self.cols + self.cells[:, 0]
+		self.counts = np.bincount(ids, minlength=self.cols * self.rows)
+		self.starts = np.cumsum(self.counts) - self.counts
+		self.order = np.argsort((ids & 0xFFFF).astype(np.uint16), kind="stable")
+		if self.cols * self.rows > 1 << 16:
+			high = (ids[self.order] >> 16).astype(np.uint16)
+			self.order = self.order[np.argsort(high, kind="stable")]
+
+	def neighbor_pairs(self):
+		"""
+		Yield every (i, j) candidate pair of particles lying in neighboring cells, one cell offset at a time
+		"""
+		n = len(self.cells)
+		indices = np.arange(n)
+		# Wrapping can make offsets overlap on tiny grids, so each neighbor cell is only visited once
+		offsets_x = np.unique(np.array([-1, 0, 1]) % self.cols)
+		offsets_y = np.unique(np.array([-1, 0, 1]) % self.rows)
+		for oy in offsets_y:
+			for ox in offsets_x:
+				neighbor = ((self.cells[:, 1] + oy) % self.rows) * self.cols + (self.cells[:, 0] + ox) % self.cols
+				counts = self.counts[neighbor]
+				total = int(counts.sum())
+				if total == 0:
+					continue
+				i = np.repeat(indices, counts)
+				# Position of each pair within its particle's run, shifted to the start of the neighbor cell
+				run_starts = np.cumsum(counts) - counts
+				slots = np.arange(total) - np.repeat(run_starts - self.starts[neighbor], counts)
+				yield i, self.order[slots]
+
+	def interaction_forces(self, pos: np.ndarray, env_size: tuple[int, int], settings: ParticleMovementSettings) -> np.ndarray:
+		"""
+		:return: Separation and cohesion forces applied to each particle by its neighbors within the interaction radius
+		"""
+		radius = settings.interaction_radius
+		self.build(pos, env_size, radius)
+		forces = np.zeros((len(pos), 2), np.float64)
+		env = np.array(env_size, np.float64)
+
+		for i, j in self.neighbor_pairs():
+			delta = pos[j].astype(np.float64) - pos[i]
+			delta -= env * np.round(delta / env)  # Closest wrapped copy
+			dist = np.hypot(delta[:, 0], delta[:, 1])
+			near = (dist > 0) & (dist < radius)
+			i, delta, dist = i[near], delta[near], dist[near]
+
+			# Separation pushes away harder when closer, cohesion pulls harder when further
+			strength = settings.cohesion * dist / radius - settings.separation * (1 - dist / radius)
+			weights = (strength / dist)[:, None] * delta
+			forces[:, 0] += np.bincount(i, weights=weights[:, 0], minlength=len(pos))
+			forces[:, 1] += np.bincount(i, weights=weights[:, 1], minlength=len(pos))
+		return forces
@@ -1,9 +1,12 @@
 import math
+import numpy as np
 import tkinter.filedialog
 
 
 class Vector:
 
+	__slots__ = ("x", "y")
+
 	@staticmethod
 	def zero():
 		return Vector(0, 0)
@@ -105,6 +108,20 @@ def hue(value, _saturation, alpha: int = -1) -> list[int]:
 	return [r * _saturation, g * _saturation, b * _saturation, 255 if alpha < 0 else alpha]
 
 
+def hue_array(values: np.ndarray, _saturation: float = 255) -> np.ndarray:
+	"""
+	Vectorized version of `hue`
+	:return: RGB colors (uint8) with the same shape as `values`, plus a last axis of size 3
+	"""
+	value = np.asarray(values, np.float64) % 360
+	sectors = [value < 60, value < 120, value < 180, value < 240, value < 300]
+	up, down = np.trunc(value * 255 / 60), np.trunc(value * -255 / 60)
+	r = np.select(sectors, [255, down + 510, 0, 0, up - 1020], 255)
+	g = np.select(sectors, [up, 255, 255, down + 1020, 0], 0)
+	b = np.select(sectors, [0, 0, up - 510, 255, 255], down + 1530)
+	return (np.stack((r, g, b), axis=-1) * (_saturation / 255)).astype(np.uint8)
+
+
 def save_file(title: str, contents: str, extension: str) -> bool:
 	try:
 		with tkinter.filedialog.asksaveasfile(
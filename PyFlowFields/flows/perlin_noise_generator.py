@@ -10,22 +10,25 @@ def perlin(x, y, seed=0):
 	# seed is the initial value we want to start with
 	# we also use seed function to get same set of numbers
 	# this helps to keep our perlin graph smooth
-	np.random.seed(seed)
+	# (a local generator leaves the global numpy state untouched, so noise can be created from several threads)
 	ptable = np.arange(256, dtype=int)
 
 	# shuffle our numbers in the table
-	np.random.shuffle(ptable)
+	np.random.RandomState(seed).shuffle(ptable)
 
 	# create a 2d array and then turn it one dimensional
 	# so that we can apply our dot product interpolations easily
 	ptable = np.stack([ptable, ptable]).flatten()
 
 	# grid coordinates
-	xi, yi = x.astype(int), y.astype(int)
+	xi, yi = np.floor(x).astype(int), np.floor(y).astype(int)
 
 	# distance vector coordinates
 	xg, yg = x - xi, y - yi
 
+	# wrap grid coordinates on the permutation table, so that any (even negative) coordinate can be sampled
+	xi, yi = xi & 255, yi & 255
+
 	# apply fade function to distance coordinates
 	xf, yf = fade(xg), fade(yg)
 
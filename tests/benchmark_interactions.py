@@ -0,0 +1,27 @@
+import time
+import numpy as np
+
+from PyFlowFields.flows import *
+
+# Time spent computing particle interactions through the spatial grid, at a constant particle density
+# (the population and environment grow together, so the cost should grow linearly with the population)
+DENSITY = 1000 / (500 * 500)  # particles per px²
+RUNS = [10_000, 100_000]
+FRAMES = 10
+
+movement_settings = ParticleMovementSettings(pradius=10, pseparation=2, pcohesion=0.5)
+
+for pop_size in RUNS:
+	side = int((pop_size / DENSITY) ** 0.5)
+	env_size = (side, side)
+	pos = np.random.default_rng(1).uniform(0, side, (pop_size, 2)).astype(np.float32)
+	grid = SpatialGrid()
+
+	start = time.perf_counter()
+	for _ in range(FRAMES):
+		grid.interaction_forces(pos, env_size, movement_settings)
+	elapsed = (time.perf_counter() - start) / FRAMES
+
+	print("%7d particles (%dx%d px, %dx%d cells) : %7.2f ms/frame, %5.2f µs/particle" % (
+		pop_size, side, side, grid.cols, grid.rows, elapsed * 1000, elapsed * 1e6 / pop_size
+	))
@@ -0,0 +1,39 @@
+import tracemalloc
+import numpy as np
+
+from PyFlowFields.flows import *
+
+# Peak memory used to spawn and update a population, in both particle storages
+# (10M particle objects would take several GB, so only the compact storage is measured at that size)
+ENV_SIZE = (3840, 2160)
+RUNS = [
+	(1_000_000, False),
+	(1_000_000, True),
+	(10_000_000, True)
+]
+
+ff = FlowField(FlowFieldSettings(fseed=1, fsize=[30, 30]))
+movement_settings = ParticleMovementSettings()
+
+for pop_size, compact in RUNS:
+	rdm = np.random.default_rng(1)
+
+	tracemalloc.start()
+	if compact:
+		particles = ParticleArray(rdm.uniform(0, ENV_SIZE[0], pop_size), rdm.uniform(0, ENV_SIZE[1], pop_size))
+		stored = particles.nbytes
+		particles.update(ENV_SIZE, ff, 1 / 60, 0, movement_settings)
+	else:
+		xs, ys = rdm.uniform(0, ENV_SIZE[0], pop_size).tolist(), rdm.uniform(0, ENV_SIZE[1], pop_size).tolist()
+		particles = [Particle(x, y) for x, y in zip(xs, ys)]
+		del xs, ys
+		stored = tracemalloc.get_traced_memory()[0]
+		for particle in particles:
+			particle.update(ENV_SIZE, ff, 1 / 60, 0, movement_settings)
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+
+	print("%10d particles (%s) : %6.1f bytes/particle stored, %8.1f MB peak" % (
+		pop_size, "compact" if compact else "objects", stored / pop_size, peak / 1024 ** 2
+	))
+	del particles
@@ -0,0 +1,129 @@
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")  # Headless
+
+import sys
+import time
+import pygame
+import hashlib
+import argparse
+import numpy as np
+
+from PyFlowFields import *
+
+# Runs the scenes of this folder with fixed seeds and a fixed time step through each engine backend,
+# and compares the final particle state and frame against golden outputs produced by the reference backend
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden")
+SCREEN = {"fullscreen": False, "screensize": [320, 240]}
+DT = 1 / 60
+
+SCENES = {
+	# drawing_modes_test.py
+	"drawing_modes": {"bg": [150, 0, 0], "pcolor": [255, 255, 255], "fstep": [0.2, 0.2], "fseed": 1, "particleseed": 1},
+	# data_setup.py
+	"data_linear": {
+		"bg": [30, 30, 30], "clear": False, "population": 1000, "pmode": 1, "pcolor": [255, 255, 10, 1], "pforce": 20,
+		"pvar": 0.8, "fstep": [0.075, 0.075], "particleseed": 2, "fseed": 4
+	},
+	"data_particle": {
+		"bg": [30, 30, 30], "population": 2500, "pcolor": [255, 255, 10], "pforce": 7, "pvar": 0.8,
+		"pmode": ParticleDrawingSettings.MODE_LINEAR, "fstep": [0.2, 0.2], "particleseed": 2, "fseed": 4, "pwidth": 10
+	},
+	# settings_obj_setup.py
+	"settings_obj": {
+		"fsize": [30, 30], "fvar": 2, "frange": 360, "fstep": [0.2, 0.2], "fseed": 3, "pforce": 8.5, "pvar": 0.8,
+		"pperiod": 2, "pmaxspeed": 300, "pforcespeed": True, "pmode": ParticleDrawingSettings.MODE_PARTICLE, "pwidth": 4,
+		"pcolor": lambda particle, sim_duration: hue(sim_duration * 3, 220, 5), "population": 1000, "bg": [10, 10, 10],
+		"particleseed": 3
+	}
+}
+
+# Settings overriding each scene's, selecting the engine backend (the first one produces the golden outputs)
+BACKENDS = {
+	"reference": {},
+	"dirty": {"dirty": True},
+	"compact": {"compact": True}
+}
+
+STATE_TOLERANCE = 0.5  # px, max distance from the golden position
+STATE_MIN_SHARE = 0.99  # Share of particles which must be within the tolerance
+FRAME_TOLERANCE = 0.01  # Max mean absolute difference between frames (share of the full color range)
+
+
+def particle_state(sim: FlowSimulation) -> np.ndarray:
+	"""
+	:return: (x, y, motion x, motion y) of each particle
+	"""
+	if isinstance(sim.particles, ParticleArray):
+		return np.hstack((sim.particles.pos, sim.particles.motion)).astype(np.float64)
+	return np.array([(p.x, p.y, p.motion.x, p.motion.y) for p in sim.particles], np.float64).reshape(-1, 4)
+
+
+def run(scene: dict, backend: dict, frames: int) -> tuple[np.ndarray, np.ndarray, float]:
+	"""
+	:return: Final particle state, final frame (RGB, indexed [x][y]) and time spent per frame
+	"""
+	sim = FlowSimulation.from_data({**scene, **SCREEN, **backend})
+	start = time.perf_counter()
+	for frame in range(frames):
+		sim.step(DT, frame * DT)
+	elapsed = (time.perf_counter() - start) / frames
+	return particle_state(sim), pygame.surfarray.array3d(sim.surface), elapsed
+
+
+def compare_state(state: np.ndarray, golden: np.ndarray, env_size: tuple[int, int]) -> tuple[float, float]:
+	"""
+	:return: Share of particles within the tolerance, and the median distance to the golden positions
+	"""
+	if state.shape != golden.shape:
+		return 0., np.inf
+	delta = np.abs(state[:, :2] - golden[:, :2])
+	delta = np.minimum(delta, np.array(env_size) - delta)  # Positions wrap around the environment
+	dist = np.hypot(delta[:, 0], delta[:, 1])
+	return float(np.mean(dist <= STATE_TOLERANCE)), float(np.median(dist))
+
+
+def compare_frame(frame: np.ndarray, golden: np.ndarray) -> tuple[bool, float]:
+	"""
+	:return: Whether both frames are identical, and their mean absolute difference (share of the full color range)
+	"""
+	if frame.shape != golden.shape:
+		return False, 1.
+	same = hashlib.sha1(frame.tobytes()).digest() == hashlib.sha1(golden.tobytes()).digest()
+	return same, float(np.mean(np.abs(frame.astype(np.int16) - golden.astype(np.int16))) / 255)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser("golden_regression", description="Compare engine backends against golden outputs")
+	parser.add_argument("--update", help="Regenerate golden outputs with the reference backend", action="store_true")
+	parser.add_argument("-frames", help="Frames to simulate for each scene when regenerating golden outputs", type=int, default=60, metavar="count")
+	args = parser.parse_args()
+
+	os.makedirs(GOLDEN_DIR, exist_ok=True)
+	failed = False
+	for scene_name, scene in SCENES.items():
+		state_path = os.path.join(GOLDEN_DIR, "%s.npz" % scene_name)
+		frame_path = os.path.join(GOLDEN_DIR, "%s.png" % scene_name)
+		frames = args.frames if args.update else int(np.load(state_path)["frames"])
+
+		reference_time = None
+		for backend_name, backend in BACKENDS.items():
+			state, frame, elapsed = run(scene, backend, frames)
+			if reference_time is None:
+				reference_time = elapsed
+				if args.update:
+					np.savez_compressed(state_path, state=state, frames=frames)
+					pygame.image.save(pygame.surfarray.make_surface(frame), frame_path)
+
+			state_share, state_median = compare_state(state, np.load(state_path)["state"], SCREEN["screensize"])
+			frame_same, frame_diff = compare_frame(frame, pygame.surfarray.array3d(pygame.image.load(frame_path)))
+			ok = state_share >= STATE_MIN_SHARE and (frame_same or frame_diff <= FRAME_TOLERANCE)
+			failed |= not ok
+
+			print("%-14s %-10s %s  state: %6.2f%% within %.1fpx (median %.4fpx)  frame: %s (diff %.4f)  %7.2f ms/frame  x%.2f" % (
+				scene_name, backend_name, "PASS" if ok else "FAIL",
+				state_share * 100, STATE_TOLERANCE, state_median,
+				"identical" if frame_same else "differs  ", frame_diff,
+				elapsed * 1000, reference_time / elapsed
+			))
+	pygame.quit()
+	sys.exit(1 if failed else 0)
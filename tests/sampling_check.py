@@ -0,0 +1,32 @@
+import numpy as np
+
+from PyFlowFields.flows import *
+
+# Bilinear sampling must be continuous everywhere : on the edges of a fixed size field, and while a chunked field pans
+STEP = 0.01  # Sampling step (in flow components)
+
+# Fixed size field where only the first column points along x
+ff = FlowField(FlowFieldSettings(fseed=1, fsize=[4, 4]))
+ff.fx[:] = 0
+ff.fx[:, 0] = 1
+xs = np.arange(0, 4, STEP)
+fx, _ = ff.sample_forces(xs, np.full(len(xs), 2.))
+assert np.all(fx[xs <= 0.5] == 1), "Samples before the first component center should stick to it"
+assert np.max(np.abs(np.diff(fx))) <= STEP + 1e-6, "Sampling jumps by %f on the field edge" % np.max(np.abs(np.diff(fx)))
+
+ys = np.arange(0, 4, STEP)
+fx, _ = ff.sample_forces(np.full(len(ys), 0.25), ys)
+assert np.all(fx == 1), "Samples along the edge column should stick to it"
+
+# Panning a chunked field by a fraction of a component must shift the samples by the same fraction
+chunked = ChunkedFlowField(FlowFieldSettings(fseed=1, fsize=[20, 20], fchunk=8))
+xs, ys = np.linspace(-5, 25, 200), np.linspace(3, 7, 200)
+for shift in np.arange(0, 2, 0.25):
+	chunked.origin = Vector(shift * chunked.spacing, 0)
+	panned = chunked.sample_forces(xs, ys)
+	chunked.origin = Vector.zero()
+	expected = chunked.sample_forces(xs + shift, ys)
+	assert np.allclose(panned, expected, atol=1e-4), "Panning by %.2f components shifts samples incorrectly" % shift
+chunked.close()
+
+print("Bilinear sampling is continuous")